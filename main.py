@@ -1,14 +1,210 @@
 import argparse
 import hashlib  # For creating a stable identifier from directory paths
+import json
 import logging
 import os
+import queue
+import re
 import subprocess
+import threading
 import time
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+try:
+    import imagecodecs  # Optional, enables the in-process "imagecodecs" backend
+except ImportError:
+    imagecodecs = None
 
 # Configure logging for better visibility into script execution
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+_JPEG_EXTENSIONS = ('.jpg', '.jpeg')  # Lowercase extensions of files to be converted
+_JXL_EXTENSION = '.jxl'
+_NAME_TAIL_LENGTH = max(len(ext) for ext in _JPEG_EXTENSIONS + (_JXL_EXTENSION,))
+
+# Error tags and the cjxl error messages (matched case-insensitively) they are reported for
+_CJXL_ERRORS = {
+    "corrupt_or_unsupported_jpeg": "Error while decoding the JPEG image",
+    "unsupported_input_type": "unsupported input type",
+    "cjxl_out_of_memory": "out of memory",
+    "cjxl_encoding_failed": "EncodeImageJXL() failed",
+}
+# One named group per error tag, so the tag of a match is its lastgroup
+_CJXL_ERROR_RE = re.compile(
+    "|".join(f"(?P<{error_tag}>{re.escape(message)})" for error_tag, message in _CJXL_ERRORS.items()),
+    re.IGNORECASE)
+
+# Every error tag convert_image can report
+_ERROR_TAGS = (
+    *_CJXL_ERRORS,
+    "generic_cjxl_failure",
+    "cjxl_not_found",
+    "cjxl_execution_error_subprocess",
+    "imagecodecs_encoding_failed",
+    "file_system_error",
+    "timestamp_preservation_failed",
+    "jxl_file_exists",
+    "no_size_reduction",
+    "unexpected_python_error",
+    "unknown_error",
+)
+
+# Directories modified less than this long ago (in ns) are not added to the scan cache yet
+_SCAN_CACHE_SETTLE_NS = 2 * 10 ** 9
+
+# Whether _atomic_write should try O_TMPFILE, cleared once it turns out to be unsupported
+_use_o_tmpfile = hasattr(os, "O_TMPFILE")
+
+
+def _write_all(fd, data):
+    """
+    Writes all of data to the file descriptor, retrying on partial writes.
+    """
+    unwritten_data = memoryview(data)
+    while unwritten_data:
+        unwritten_data = unwritten_data[os.write(fd, unwritten_data):]
+
+
+def _write_anonymous_then_link(file_path, temp_file_path, data):
+    """
+    Writes data to an anonymous O_TMPFILE inode in the directory of file_path and links it
+    as temp_file_path once complete. Until then the data has no name, so a crash can't leave
+    a partially written file behind.
+    """
+    fd = os.open(os.path.dirname(file_path) or ".", os.O_TMPFILE | os.O_WRONLY, 0o644)
+    try:
+        _write_all(fd, data)
+        # linkat() can't replace an existing file, clear what an earlier crash may have left
+        try:
+            os.remove(temp_file_path)
+        except FileNotFoundError:
+            pass
+        # Without a dir fd, os.link() calls link(), which tries to link the /proc symlink itself and
+        # fails with EXDEV. Passing one makes it call linkat(AT_SYMLINK_FOLLOW), following the symlink
+        # to the anonymous inode. The source path is absolute, so linkat() ignores the fd itself.
+        os.link(f"/proc/self/fd/{fd}", temp_file_path, src_dir_fd=fd)
+    finally:
+        os.close(fd)
+
+
+def _atomic_write(file_path, data):
+    """
+    Atomically replaces file_path with a file containing data.
+
+    On Linux the data is written to an anonymous O_TMPFILE inode first. If that isn't available
+    (other platforms, filesystems without O_TMPFILE support, /proc not mounted), a named temporary
+    file next to file_path is written instead, which is removed again if writing fails.
+
+    Raises:
+        OSError: If the file could not be written.
+    """
+    global _use_o_tmpfile
+    temp_file_path = file_path + ".tmp"
+    if _use_o_tmpfile:
+        try:
+            _write_anonymous_then_link(file_path, temp_file_path, data)
+            os.replace(temp_file_path, file_path)
+            return
+        except OSError as e:
+            # Don't retry for every file, the result won't be different next time
+            _use_o_tmpfile = False
+            logging.debug(f"Could not write {file_path} through O_TMPFILE, using temporary files from now on: {e}")
+
+    try:
+        fd = os.open(temp_file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            _write_all(fd, data)
+        finally:
+            os.close(fd)
+        os.replace(temp_file_path, file_path)
+    except OSError:
+        # Don't leave the temporary file behind
+        try:
+            os.remove(temp_file_path)
+        except OSError:
+            pass
+        raise
+
+
+def _rename_no_replace(src_path, dst_path):
+    """
+    Renames src_path to dst_path, never replacing an existing file at dst_path.
+
+    Raises:
+        FileExistsError: If dst_path already exists.
+        OSError: If the file could not be renamed.
+    """
+    if os.name == "nt":
+        os.rename(src_path, dst_path)  # Fails if dst_path exists on Windows
+        return
+    try:
+        # Unlike rename(), link() fails if the new name exists
+        os.link(src_path, dst_path)
+    except FileExistsError:
+        raise
+    except OSError:
+        # Filesystems without hard links: claim the name exclusively, then move the file onto the claim
+        os.close(os.open(dst_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+        try:
+            os.replace(src_path, dst_path)
+        except OSError:
+            os.remove(dst_path)
+            raise
+    else:
+        os.remove(src_path)
+
+
+@dataclass(slots=True)
+class DirMetrics:
+    """
+    Conversion metrics of a single source directory.
+    """
+    total_conversions: int = 0
+    successful_conversions: int = 0
+    failed_conversions: int = 0
+    # Failure count per error tag. All known tags are present up front, so counting is a plain increment.
+    failed_reasons: dict = field(default_factory=lambda: dict.fromkeys(_ERROR_TAGS, 0))
+    total_space_saved_bytes: int = 0
+    last_interval_space_saved_bytes: int = 0
+    # Metrics for average size calculation
+    total_original_bytes_processed: int = 0
+    total_converted_bytes_processed: int = 0
+    # Images found in the last run that were not converted because they are smaller than min_size_bytes.
+    # Per run, as the same images are found again whenever their directory is listed.
+    last_interval_skipped_too_small: int = 0
+
+    # Cumulative counters that are saved between runs, everything except failed_reasons and
+    # the per-run last_interval_* values
+    _PERSISTED_COUNTERS = ('total_conversions', 'successful_conversions', 'failed_conversions',
+                           'total_space_saved_bytes', 'total_original_bytes_processed',
+                           'total_converted_bytes_processed')
+
+    def to_state(self):
+        """
+        Returns the cumulative metrics as a JSON-serializable dict.
+        """
+        state = {name: getattr(self, name) for name in self._PERSISTED_COUNTERS}
+        state['failed_reasons'] = {reason: count for reason, count in self.failed_reasons.items() if count}
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        """
+        Creates DirMetrics holding the cumulative metrics of a dict returned by to_state().
+
+        Raises:
+            ValueError: If the state is malformed.
+        """
+        try:
+            metrics = cls(**{name: int(state.get(name, 0)) for name in cls._PERSISTED_COUNTERS})
+            metrics.failed_reasons.update(
+                {str(reason): int(count) for reason, count in state.get('failed_reasons', {}).items()})
+        except (AttributeError, TypeError, ValueError) as e:
+            raise ValueError(f"Malformed metrics state: {e}") from e
+        return metrics
+
 
 class JxlConverter:
     """
@@ -16,7 +212,42 @@ class JxlConverter:
     via the Node Exporter's textfile collector, with separate reports per directory.
     """
 
-    def __init__(self, source_directories, metrics_root_directory, cjxl_path="cjxl"):
+    # HELP/TYPE lines of every exported metric as (metric name, DirMetrics field, header),
+    # in the order they appear in the metrics file. They never change, so format them only once.
+    _METRICS_HEADERS = tuple(
+        (metric_name, metrics_key, f"# HELP {metric_name} {help_text}\n# TYPE {metric_name} {metric_type}\n")
+        for metric_name, metric_type, metrics_key, help_text in (
+            ("jpeg_to_jxl_conversions_total", "counter", "total_conversions",
+             "Total JPEG to JXL conversions attempted per directory."),
+            ("jpeg_to_jxl_conversions_successful_total", "counter", "successful_conversions",
+             "Total successful JPEG to JXL conversions per directory."),
+            # Labeled by reason
+            ("jpeg_to_jxl_conversions_failed_total", "counter", "failed_reasons",
+             "Total failed JPEG to JXL conversions per directory."),
+            ("jpeg_to_jxl_space_saved_bytes_total", "gauge", "total_space_saved_bytes",
+             "Total space saved by JXL conversions in bytes per directory."),
+            ("jpeg_to_jxl_space_saved_bytes_last_interval", "gauge", "last_interval_space_saved_bytes",
+             "Space saved in the last conversion interval in bytes per directory."),
+            # Cumulative totals of successful conversions, for average size calculation
+            ("jpeg_to_jxl_original_bytes_processed_total", "gauge", "total_original_bytes_processed",
+             "Total bytes of original files processed successfully per directory."),
+            ("jpeg_to_jxl_converted_bytes_processed_total", "gauge", "total_converted_bytes_processed",
+             "Total bytes of converted JXL files processed successfully per directory."),
+            ("jpeg_to_jxl_skipped_too_small_last_interval", "gauge", "last_interval_skipped_too_small",
+             "JPEG files skipped for being smaller than the minimum size in the last conversion interval "
+             "per directory. Directories skipped by the scan cache are not counted."),
+        )
+    )
+
+    # Maps the characters replaced in failure reason labels to an underscore
+    _REASON_TRANSLATION = str.maketrans(" -", "__")
+
+    # DirMetrics fields that are exported as a single sample
+    _METRICS_VALUE_KEYS = tuple(metrics_key for _, metrics_key, _ in _METRICS_HEADERS if metrics_key != 'failed_reasons')
+
+    def __init__(self, source_directories, metrics_root_directory, cjxl_path="cjxl", jobs=None, backend="auto",
+                 effort=None, distance=None, lossless_jpeg=None, faster_decoding=None, min_size_bytes=0,
+                 use_scan_cache=True, create_dummies=False):
         """
         Initializes the JxlConverter for multiple source directories.
 
@@ -26,64 +257,348 @@ class JxlConverter:
                                           Node Exporter should be configured to read from this path.
             cjxl_path (str): The path to the cjxl executable. Defaults to "cjxl"
                              assuming it's in the system's PATH.
+            jobs (int): The number of cjxl conversions to run concurrently, at least 1. Defaults to the
+                        number of CPUs available on the system.
+            backend (str): How images are encoded: "cli" runs cjxl for every file, "imagecodecs"
+                           encodes in-process with the imagecodecs package, avoiding the process
+                           startup cost per file. Falls back to "cli" if imagecodecs is not installed.
+                           "auto" (the default) uses imagecodecs if it is installed, no cjxl
+                           options are given and cjxl_path is the default, and "cli" otherwise.
+            effort (int): cjxl encoder effort (1-10). Lower is faster. None uses the cjxl default (7).
+            distance (float): cjxl Butteraugli distance, 0 is mathematically lossless. Only used when
+                              lossless_jpeg is 0. None uses the cjxl default.
+            lossless_jpeg (int): 1 to losslessly transcode the JPEG data (reconstructable), 0 to re-encode
+                                 the decoded pixels. None uses the cjxl default (1).
+            faster_decoding (int): cjxl decoding speed tier (0-4), higher values trade size for
+                                   faster decoding. None uses the cjxl default (0).
+            min_size_bytes (int): Images smaller than this are not converted. For tiny images, the
+                                  cjxl startup dominates and the JXL file may not even be smaller.
+                                  Defaults to 0, converting all images.
+            use_scan_cache (bool): Whether to remember directories that had nothing to convert and images
+                                   that did not get smaller as JXL across runs, and skip them again
+                                   while they are unchanged.
+            create_dummies (bool): Whether to fill missing source directories that get created with
+                                   dummy JPG files for testing. Defaults to False.
         Raises:
             FileNotFoundError: If any of the specified source_directories do not exist and cannot be created.
+            ValueError: If jobs is less than 1, or the cjxl options are out of range or cannot be combined.
         """
+        # Validated before anything touches the file system
+        if jobs is not None and jobs < 1:
+            raise ValueError(f"jobs must be at least 1, got {jobs}")
         self.cjxl_path = cjxl_path
         self.metrics_root_directory = metrics_root_directory
-        self.metrics_data = {}  # Stores metrics for each source directory
+        self.jobs = jobs if jobs is not None else (os.cpu_count() or 1)
+        self.backend = backend
+        self.min_size_bytes = min_size_bytes
+        self.use_scan_cache = use_scan_cache
+        self._metrics_min_interval = 5.0  # Minimum seconds between metrics file updates during a run
+        self._last_metrics_emit = 0.0  # time.monotonic() of the last metrics file update
+        self.cjxl_args = self._build_cjxl_args(effort, distance, lossless_jpeg, faster_decoding)
+        # imagecodecs loads its codecs lazily and installs functions that raise when called if a
+        # codec extension is missing, so only its codec constants tell whether JPEG XL works
+        imagecodecs_available = bool(getattr(getattr(imagecodecs, "JPEGXL", None), "available", False))
+        if self.backend == "auto":
+            # The cjxl options are only understood by cjxl itself, and a cjxl executable other
+            # than the default one is only given to be used
+            use_cjxl = self.cjxl_args or cjxl_path != "cjxl"
+            self.backend = "imagecodecs" if imagecodecs_available and not use_cjxl else "cli"
+            if imagecodecs is not None and not imagecodecs_available:
+                logging.info("imagecodecs is installed without JPEG XL support, using the cjxl command-line tool.")
+        elif self.backend == "imagecodecs":
+            if not imagecodecs_available:
+                logging.warning("The imagecodecs backend requires the imagecodecs package with JPEG XL support. "
+                                "Falling back to the cjxl command-line tool.")
+                self.backend = "cli"
+            elif self.cjxl_args:
+                logging.warning("The cjxl options are ignored by the imagecodecs backend.")
+        self.metrics_data = {}  # Stores the DirMetrics of each source directory
+        self._prom_labels = {}  # Prometheus 'directory' label value for each source directory
+        self._metrics_templates = {}  # Metrics file content template for each source directory
+        self._metrics_file_paths = {}  # Metrics file path for each source directory
+        self._state_file_paths = {}  # Path of the file saving the cumulative metrics of each source directory
+        self._standardized_reasons = {}  # Cache of _standardize_reason results
+        self._last_content_hash = {}  # Digest of the metrics file content last written for each source directory
 
-        for s_dir in source_directories:
-            abs_s_dir = os.path.abspath(s_dir)  # Use absolute path for consistency
+        # A directory below another source directory is already scanned as part of it. Scanning it
+        # twice would queue its images twice and let two workers convert the same file at once.
+        abs_source_dirs = list(dict.fromkeys(os.path.abspath(s_dir) for s_dir in source_directories))
+        real_source_dirs = [os.path.join(os.path.realpath(abs_s_dir), "") for abs_s_dir in abs_source_dirs]
+        # Of several paths of the same directory, the first one is kept.
+        for index, (abs_s_dir, real_s_dir) in enumerate(zip(abs_source_dirs, real_source_dirs)):
+            containing_dir = next((abs_source_dirs[other_index]
+                                   for other_index, other_real_dir in enumerate(real_source_dirs)
+                                   if real_s_dir.startswith(other_real_dir)
+                                   and (real_s_dir != other_real_dir or other_index < index)),
+                                  None)
+            if containing_dir is not None:
+                logging.warning(f"Ignoring source directory '{abs_s_dir}', it is already scanned "
+                                f"as part of '{containing_dir}'.")
+                continue
             if not os.path.isdir(abs_s_dir):
                 logging.warning(f"Source directory '{abs_s_dir}' not found.")
                 try:
                     os.makedirs(abs_s_dir, exist_ok=True)
-                    self._create_dummy_files(abs_s_dir)
-                    logging.info(f"Source directory '{abs_s_dir}' created with dummy files.")
+                    if create_dummies:
+                        self._create_dummy_files(abs_s_dir)
+                        logging.info(f"Source directory '{abs_s_dir}' created with dummy files.")
+                    else:
+                        logging.info(f"Source directory '{abs_s_dir}' created.")
                 except Exception as e:
                     raise FileNotFoundError(
                         f"Source directory not found and could not create it: {abs_s_dir}. Error: {e}")
 
-            # Initialize metrics for each directory
-            self.metrics_data[abs_s_dir] = {
-                'total_conversions': 0,
-                'successful_conversions': 0,
-                'failed_conversions': 0,
-                'failed_reasons': Counter(),
-                'total_space_saved_bytes': 0,
-                'last_interval_space_saved_bytes': 0,
-                # New metrics for average size calculation
-                'total_original_bytes_processed': 0,
-                'total_converted_bytes_processed': 0
-            }
+            # Sanitize directory path for Prometheus label (replace non-alphanumeric with underscore)
+            # Using the original source_dir directly in the label is generally fine for Prometheus.
+            self._prom_labels[abs_s_dir] = \
+                abs_s_dir.replace("\\", "/").replace(":", "_").replace(" ", "_")  # Simple sanitization
+            self._metrics_templates[abs_s_dir] = self._build_metrics_template(self._prom_labels[abs_s_dir])
+            # Create a safe, unique identifier for the directory for the metrics filename
+            # Using a BLAKE2b hash to ensure unique and safe filenames for metrics files
+            dir_hash = hashlib.blake2b(abs_s_dir.encode('utf-8'), digest_size=8).hexdigest()
+            self._metrics_file_paths[abs_s_dir] = os.path.join(self.metrics_root_directory,
+                                                               f"jxl_conversion_metrics_{dir_hash}.prom")
+            self._state_file_paths[abs_s_dir] = os.path.join(self.metrics_root_directory,
+                                                             f"jxl_conversion_state_{dir_hash}.json")
+            self._remove_legacy_metrics_file(abs_s_dir)
+
+            # Initialize metrics for each directory, continuing from the previous run if possible
+            self.metrics_data[abs_s_dir] = self._load_state(abs_s_dir)
             logging.info(f"Initialized metrics for directory: {abs_s_dir}")
 
         # Ensure the metrics root directory exists for Node Exporter
         os.makedirs(self.metrics_root_directory, exist_ok=True)
+        self._scan_cache_file_path = os.path.join(self.metrics_root_directory, ".jxl_scan_cache.json")
+        self._scan_cache, self._kept_originals = self._load_scan_cache()
+        self._next_scan_cache = {}
+        self._next_kept_originals = {}
+        self._listed_directories = set()  # Directories listed during the last scan
         logging.info(f"JXL Converter initialized.")
         logging.info(f"Scanning images in: {', '.join(self.metrics_data.keys())}")
         logging.info(f"Prometheus metrics will be written to: {self.metrics_root_directory}")
-        logging.info(f"Using cjxl executable at: {self.cjxl_path}")
+        if self.backend == "imagecodecs":
+            logging.info(f"Using imagecodecs {imagecodecs.__version__} for encoding")
+        else:
+            logging.info(f"Using cjxl executable at: {self.cjxl_path}")
+            if self.cjxl_args:
+                logging.info(f"Passing extra options to cjxl: {' '.join(self.cjxl_args)}")
+        logging.info(f"Running up to {self.jobs} conversions in parallel")
+        self._stop_event = threading.Event()  # Set to stop a running conversion pipeline early
+        self._work_queue = None  # Work queue of the running or last conversion pipeline
+        # Created last, so a failing __init__ doesn't leave worker threads behind
+        self._pool = ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix="jxl-worker")
+        if self.min_size_bytes:
+            logging.info(f"Skipping images smaller than {self.min_size_bytes} bytes")
+
+    def close(self):
+        """
+        Stops a running conversion pipeline and shuts down the conversion worker pool.
+        Waits for the conversions that are already running to finish, the remaining images
+        are left for the next run.
+        """
+        self._stop_event.set()
+        if self._work_queue is not None:
+            # Drop the queued images, unblocking a scanner waiting for space in the queue, and
+            # make sure every worker gets a sentinel even if the drained ones were among them.
+            # That leaves enough space for the sentinels the scanner puts once it has stopped.
+            try:
+                while True:
+                    self._work_queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                for _ in range(self.jobs):
+                    self._work_queue.put_nowait(None)
+            except queue.Full:
+                pass
+        self._pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _remove_legacy_metrics_file(self, source_dir):
+        """
+        Removes the metrics file of a source directory written by older versions, which named it
+        after the MD5 hash of the directory. Node Exporter would otherwise export its series twice.
+        """
+        legacy_dir_hash = hashlib.md5(source_dir.encode('utf-8')).hexdigest()
+        legacy_file_path = os.path.join(self.metrics_root_directory, f"jxl_conversion_metrics_{legacy_dir_hash}.prom")
+        try:
+            os.remove(legacy_file_path)
+            logging.info(f"Removed legacy metrics file for '{source_dir}': {legacy_file_path}")
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Could not remove legacy metrics file {legacy_file_path}: {e}")
+
+    def _standardize_reason(self, reason):
+        """
+        Returns the Prometheus label value of a failure reason. Prometheus labels should be
+        alphanumeric and underscores, so error reasons are standardized for cleaner labels.
+        The set of reasons is small and fixed, so every reason is only converted once.
+        """
+        standardized_reason = self._standardized_reasons.get(reason)
+        if standardized_reason is None:
+            standardized_reason = reason.translate(self._REASON_TRANSLATION).lower()
+            self._standardized_reasons[reason] = standardized_reason
+        return standardized_reason
+
+    @classmethod
+    def _build_metrics_template(cls, prom_label_dir):
+        """
+        Builds the content of a metrics file for the given directory label as a str.format template.
+        It has a placeholder named after the DirMetrics field for every single sample value and a
+        'failed_reasons' placeholder for all jpeg_to_jxl_conversions_failed_total lines.
+        """
+        escaped_label = prom_label_dir.replace("{", "{{").replace("}", "}}")
+        template_parts = []
+        for metric_name, metrics_key, header in cls._METRICS_HEADERS:
+            template_parts.append(header.replace("{", "{{").replace("}", "}}"))
+            if metrics_key == 'failed_reasons':
+                template_parts.append("{failed_reasons}")
+            else:
+                template_parts.append(f'{metric_name}{{{{directory="{escaped_label}"}}}} {{{metrics_key}}}\n')
+        return "".join(template_parts)
+
+    def _load_state(self, source_dir):
+        """
+        Loads the cumulative metrics of a source directory saved by a previous run, so counters
+        and gauges don't reset when the script restarts.
+
+        Returns:
+            DirMetrics: The restored metrics, or empty metrics if there is no usable saved state.
+        """
+        state_file_path = self._state_file_paths[source_dir]
+        try:
+            with open(state_file_path, "rb") as f:
+                metrics = DirMetrics.from_state(json.load(f))
+        except FileNotFoundError:
+            return DirMetrics()
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not load saved metrics for '{source_dir}' from {state_file_path}, "
+                            f"starting from zero: {e}")
+            return DirMetrics()
+        logging.info(f"Restored saved metrics for '{source_dir}' from {state_file_path}")
+        return metrics
+
+    def _load_scan_cache(self):
+        """
+        Loads the scan cache of the previous run. It maps the paths of directories that had nothing
+        to convert to [st_dev, st_ino, st_mtime_ns, [subdirectory names]], and the paths of images
+        that did not get smaller as JXL to [st_size, st_mtime_ns].
+
+        Returns:
+            tuple: (directories (dict), kept_originals (dict)) of the scan cache, both empty if it
+                   is disabled or there is no usable cache file.
+        """
+        if not self.use_scan_cache:
+            return {}, {}
+        try:
+            with open(self._scan_cache_file_path, "rb") as f:
+                scan_cache = json.load(f)
+        except FileNotFoundError:
+            return {}, {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not load scan cache from {self._scan_cache_file_path}, rescanning everything: {e}")
+            return {}, {}
+        directories = scan_cache.get("directories") if isinstance(scan_cache, dict) else None
+        kept_originals = scan_cache.get("kept_originals") if isinstance(scan_cache, dict) else None
+        if not isinstance(directories, dict) or not isinstance(kept_originals, dict):
+            logging.warning(f"Ignoring malformed scan cache {self._scan_cache_file_path}")
+            return {}, {}
+        return directories, kept_originals
+
+    def _save_scan_cache(self):
+        """
+        Replaces the scan cache with the directories and kept originals found during the last scan.
+        """
+        if not self.use_scan_cache:
+            return
+        # Keep the entries of source directories that were not scanned in this run, and the kept
+        # originals in directories an interrupted run did not get to. The kept originals in listed
+        # directories that are still unchanged were carried over by the scan.
+        scanned_prefixes = tuple(os.path.join(source_dir, "") for source_dir in self.metrics_data)
+        for directory, cached in self._scan_cache.items():
+            if directory not in self.metrics_data and not directory.startswith(scanned_prefixes):
+                self._next_scan_cache.setdefault(directory, cached)
+        for filepath, kept in self._kept_originals.items():
+            if not filepath.startswith(scanned_prefixes) or \
+                    (self._stop_event.is_set() and os.path.dirname(filepath) not in self._listed_directories):
+                self._next_kept_originals.setdefault(filepath, kept)
+        if self._next_scan_cache == self._scan_cache and self._next_kept_originals == self._kept_originals:
+            return
+        scan_cache = {"directories": self._next_scan_cache, "kept_originals": self._next_kept_originals}
+        try:
+            _atomic_write(self._scan_cache_file_path, json.dumps(scan_cache).encode())
+        except OSError as e:
+            logging.error(f"Error saving scan cache {self._scan_cache_file_path}: {e}")
+        self._scan_cache = self._next_scan_cache
+        self._kept_originals = self._next_kept_originals
+
+    def _save_state(self, source_dir):
+        """
+        Saves the cumulative metrics of a source directory for the next run.
+        """
+        state_file_path = self._state_file_paths[source_dir]
+        try:
+            _atomic_write(state_file_path, json.dumps(self.metrics_data[source_dir].to_state()).encode())
+        except OSError as e:
+            logging.error(f"Error saving metrics state {state_file_path} for '{source_dir}': {e}")
+
+    @staticmethod
+    def _build_cjxl_args(effort, distance, lossless_jpeg, faster_decoding):
+        """
+        Validates the cjxl encoder options and builds the matching command-line arguments.
+        Options that are None are left out so cjxl applies its own defaults.
+
+        Raises:
+            ValueError: If an option is out of range or the options cannot be combined.
+        """
+        cjxl_args = []
+        if effort is not None:
+            if not 1 <= effort <= 10:
+                raise ValueError(f"cjxl effort must be between 1 and 10, got {effort}")
+            cjxl_args.append(f"--effort={effort}")
+        if lossless_jpeg is not None:
+            if lossless_jpeg not in (0, 1):
+                raise ValueError(f"cjxl lossless_jpeg must be 0 or 1, got {lossless_jpeg}")
+            cjxl_args.append(f"--lossless_jpeg={lossless_jpeg}")
+        if distance is not None:
+            if distance < 0:
+                raise ValueError(f"cjxl distance must not be negative, got {distance}")
+            # Lossless JPEG transcoding keeps the original DCT data, a lossy distance can't be applied to it
+            if lossless_jpeg != 0 and distance != 0:
+                raise ValueError("A non-zero cjxl distance requires lossless_jpeg to be 0")
+            cjxl_args.append(f"--distance={distance}")
+        if faster_decoding is not None:
+            if not 0 <= faster_decoding <= 4:
+                raise ValueError(f"cjxl faster_decoding must be between 0 and 4, got {faster_decoding}")
+            cjxl_args.append(f"--faster_decoding={faster_decoding}")
+        return cjxl_args
 
     def _create_dummy_files(self, directory):
         """
         Creates some dummy JPG files for testing purposes if the directory is empty.
+        They only need to look like JPEGs by name, so they are filled with zeros
+        instead of random data, which is much faster to produce.
         """
         if not os.listdir(directory):  # Only create if directory is empty
             logging.info(f"Creating dummy JPG files in '{directory}' for testing.")
             try:
-                # Create a dummy large JPG file (5 MB random data)
+                # Create a dummy large JPG file (5 MB of zeros)
                 with open(os.path.join(directory, "test_image_large.jpg"), "wb") as f:
-                    f.write(os.urandom(1024 * 1024 * 5))
-                # Create a dummy medium JPG file (500 KB random data)
+                    f.write(bytes(1024 * 1024 * 5))
+                # Create a dummy medium JPG file (500 KB of zeros)
                 with open(os.path.join(directory, "test_image_medium.jpeg"), "wb") as f:
-                    f.write(os.urandom(1024 * 500))
+                    f.write(bytes(1024 * 500))
                 # Create a subdirectory and another dummy file
                 subdir = os.path.join(directory, "subdirectory")
                 os.makedirs(subdir, exist_ok=True)
                 with open(os.path.join(subdir, "another_image.jpg"), "wb") as f:
-                    f.write(os.urandom(1024 * 700))  # 700 KB random data
+                    f.write(bytes(1024 * 700))  # 700 KB of zeros
                 logging.info("Dummy JPG files successfully created.")
             except Exception as e:
                 logging.error(f"Failed to create dummy files in '{directory}': {e}")
@@ -95,98 +610,224 @@ class JxlConverter:
         in the specified metrics root directory.
         """
         for source_dir, metrics in self.metrics_data.items():
-            metrics_content = []
-            # Create a safe, unique identifier for the directory for the filename and labels
-            # Using MD5 hash to ensure unique and safe filenames for metrics files
-            dir_hash = hashlib.md5(source_dir.encode('utf-8')).hexdigest()
-            # Sanitize directory path for Prometheus label (replace non-alphanumeric with underscore)
-            # Using the original source_dir directly in the label is generally fine for Prometheus.
-            prom_label_dir = source_dir.replace("\\", "/").replace(":", "_").replace(" ", "_")  # Simple sanitization
-
-            # Total conversions attempted
-            metrics_content.append(
-                f"# HELP jpeg_to_jxl_conversions_total Total JPEG to JXL conversions attempted per directory.")
-            metrics_content.append(f"# TYPE jpeg_to_jxl_conversions_total counter")
-            metrics_content.append(
-                f'jpeg_to_jxl_conversions_total{{directory="{prom_label_dir}"}} {metrics["total_conversions"]}')
-
-            # Total successful conversions
-            metrics_content.append(
-                f"# HELP jpeg_to_jxl_conversions_successful_total Total successful JPEG to JXL conversions per directory.")
-            metrics_content.append(f"# TYPE jpeg_to_jxl_conversions_successful_total counter")
-            metrics_content.append(
-                f'jpeg_to_jxl_conversions_successful_total{{directory="{prom_label_dir}"}} {metrics["successful_conversions"]}')
-
-            # Total failed conversions, labeled by reason
-            metrics_content.append(
-                f"# HELP jpeg_to_jxl_conversions_failed_total Total failed JPEG to JXL conversions per directory.")
-            metrics_content.append(f"# TYPE jpeg_to_jxl_conversions_failed_total counter")
-            if not metrics['failed_reasons']:
+            prom_label_dir = self._prom_labels[source_dir]
+            metrics_file_path = self._metrics_file_paths[source_dir]
+
+            # Only reasons that actually occurred are exported
+            failed_reasons_lines = "".join(
+                f'jpeg_to_jxl_conversions_failed_total{{directory="{prom_label_dir}",'
+                f'reason="{self._standardize_reason(reason)}"}} {count}\n'
+                for reason, count in metrics.failed_reasons.items() if count)
+            if not failed_reasons_lines:
                 # Ensure the metric exists even if no failures occurred
-                metrics_content.append(
-                    f'jpeg_to_jxl_conversions_failed_total{{directory="{prom_label_dir}",reason="none"}} 0')
-            else:
-                for reason, count in metrics['failed_reasons'].items():
-                    # Prometheus labels should be alphanumeric and underscores.
-                    # Standardize common error reasons for cleaner labels.
-                    standardized_reason = reason.replace(" ", "_").replace("-", "_").lower()
-                    metrics_content.append(
-                        f'jpeg_to_jxl_conversions_failed_total{{directory="{prom_label_dir}",reason="{standardized_reason}"}} {count}')
-
-            # Cumulative total space saved
-            metrics_content.append(
-                f"# HELP jpeg_to_jxl_space_saved_bytes_total Total space saved by JXL conversions in bytes per directory.")
-            metrics_content.append(f"# TYPE jpeg_to_jxl_space_saved_bytes_total gauge")
-            metrics_content.append(
-                f'jpeg_to_jxl_space_saved_bytes_total{{directory="{prom_label_dir}"}} {metrics["total_space_saved_bytes"]}')
-
-            # Space saved in the last (current) run
-            metrics_content.append(
-                f"# HELP jpeg_to_jxl_space_saved_bytes_last_interval Space saved in the last conversion interval in bytes per directory.")
-            metrics_content.append(f"# TYPE jpeg_to_jxl_space_saved_bytes_last_interval gauge")
-            metrics_content.append(
-                f'jpeg_to_jxl_space_saved_bytes_last_interval{{directory="{prom_label_dir}"}} {metrics["last_interval_space_saved_bytes"]}')
-
-            # NEW: Cumulative total original bytes processed (for successful conversions)
-            metrics_content.append(
-                f"# HELP jpeg_to_jxl_original_bytes_processed_total Total bytes of original files processed successfully per directory.")
-            metrics_content.append(f"# TYPE jpeg_to_jxl_original_bytes_processed_total gauge")
-            metrics_content.append(
-                f'jpeg_to_jxl_original_bytes_processed_total{{directory="{prom_label_dir}"}} {metrics["total_original_bytes_processed"]}')
-
-            # NEW: Cumulative total converted bytes processed (for successful conversions)
-            metrics_content.append(
-                f"# HELP jpeg_to_jxl_converted_bytes_processed_total Total bytes of converted JXL files processed successfully per directory.")
-            metrics_content.append(f"# TYPE jpeg_to_jxl_converted_bytes_processed_total gauge")
-            metrics_content.append(
-                f'jpeg_to_jxl_converted_bytes_processed_total{{directory="{prom_label_dir}"}} {metrics["total_converted_bytes_processed"]}')
-
-            # Define the path for the metrics file specific to this directory
-            metrics_file_name = f"jxl_conversion_metrics_{dir_hash}.prom"
-            metrics_file_path = os.path.join(self.metrics_root_directory, metrics_file_name)
-            temp_metrics_file_path = metrics_file_path + ".tmp"  # Use a temporary file for atomic write
+                failed_reasons_lines = \
+                    f'jpeg_to_jxl_conversions_failed_total{{directory="{prom_label_dir}",reason="none"}} 0\n'
+
+            # Everything but the values is precomputed in the template, fill it in with a single call
+            metrics_content = self._metrics_templates[source_dir].format(
+                failed_reasons=failed_reasons_lines,
+                **{metrics_key: getattr(metrics, metrics_key) for metrics_key in self._METRICS_VALUE_KEYS}).encode()
+
+            # Skip rewriting the file if nothing changed since it was last written
+            content_hash = hashlib.blake2b(metrics_content, digest_size=8).digest()
+            if self._last_content_hash.get(source_dir) == content_hash:
+                logging.debug(f"Metrics for '{source_dir}' unchanged, not rewriting {metrics_file_path}")
+                continue
 
             try:
-                # Write metrics to a temporary file first
-                with open(temp_metrics_file_path, "w") as f:
-                    f.write("\n".join(metrics_content) + "\n")  # Add a newline at the end
                 # Atomically replace the old metrics file with the new one
-                os.replace(temp_metrics_file_path, metrics_file_path)
+                _atomic_write(metrics_file_path, metrics_content)
+                self._last_content_hash[source_dir] = content_hash
                 logging.info(f"Metrics for '{source_dir}' successfully written to {metrics_file_path}")
             except IOError as e:
                 logging.error(f"Error writing metrics file {metrics_file_path} for '{source_dir}': {e}")
             except Exception as e:
                 logging.error(f"An unexpected error occurred while generating metrics file for '{source_dir}': {e}")
 
-    def convert_image(self, input_filepath, metrics_for_current_dir):
+            # The metrics file holds every cumulative value, so the state only changes along with it
+            self._save_state(source_dir)
+
+    def _iter_jpegs(self, directory, source_dir, skipped_too_small):
+        """
+        Recursively yields the os.DirEntry of every JPEG/JPG file below the given directory,
+        skipping images that already have a JXL file next to them. Images below min_size_bytes
+        are counted for source_dir in the skipped_too_small Counter instead.
+
+        Directories that had nothing to convert are remembered in the scan cache with their
+        (st_dev, st_ino, st_mtime_ns) and subdirectory names. As long as that triple is unchanged,
+        no entries were added, removed or renamed in the directory, so listing it is skipped
+        and only its subdirectories are checked. Images that did not get smaller as JXL before
+        are skipped while their size and mtime are unchanged.
+        """
+        if self._stop_event.is_set():
+            return  # Directories that are not visited are not cached, so they are scanned next time
+        try:
+            directory_stat = os.stat(directory)
+        except OSError as e:
+            logging.warning("Could not scan directory '%s': %s", directory, e)
+            return
+        directory_key = [directory_stat.st_dev, directory_stat.st_ino, directory_stat.st_mtime_ns]
+
+        cached = self._scan_cache.get(directory)
+        if cached is not None and cached[:3] == directory_key:
+            self._next_scan_cache[directory] = cached
+            for subdirectory_name in cached[3]:
+                yield from self._iter_jpegs(os.path.join(directory, subdirectory_name), source_dir,
+                                            skipped_too_small)
+            return
+
+        jpeg_entries = []
+        jxl_stems = set()  # Images that already have a JXL sibling were converted before
+        subdirectories = []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry)
+                    elif entry.is_file():
+                        # Check for common JPEG file extensions (case-insensitive). Only the tail
+                        # of the name is lowercased, which is all the extension checks need.
+                        name_tail = entry.name[-_NAME_TAIL_LENGTH:].lower()
+                        if name_tail.endswith(_JPEG_EXTENSIONS):
+                            # Converting through a symlink would only delete the link and
+                            # duplicate the image it points to, so only real files are converted
+                            if not entry.is_symlink():
+                                jpeg_entries.append(entry)
+                        elif name_tail.endswith(_JXL_EXTENSION):
+                            jxl_stems.add(os.path.splitext(entry.name)[0])
+        except OSError as e:
+            logging.warning("Could not scan directory '%s': %s", directory, e)
+            return
+
+        found_images = False
+        holds_kept_originals = False
+        yielded_stems = set()  # Images with the same name but another extension would share one JXL file
+        for entry in jpeg_entries:
+            stem = os.path.splitext(entry.name)[0]
+            if stem in jxl_stems:
+                logging.info("  Skipping image with existing JXL file: %s", entry.path)
+                continue
+            if stem in yielded_stems:
+                logging.info("  Skipping image with the same JXL file name as another image: %s", entry.path)
+                continue
+            if self.min_size_bytes:
+                try:
+                    # Cached by the DirEntry, so convert_image doesn't stat the file again
+                    too_small = entry.stat().st_size < self.min_size_bytes
+                except OSError:
+                    too_small = False  # Let convert_image report the error
+                if too_small:
+                    # Not something left to convert, so it doesn't keep the directory out of the scan cache
+                    logging.info("  Skipping image smaller than %s bytes: %s", self.min_size_bytes, entry.path)
+                    skipped_too_small[source_dir] += 1
+                    continue
+            kept = self._kept_originals.get(entry.path)
+            if kept is not None:
+                try:
+                    entry_stat = entry.stat()
+                except OSError:
+                    pass  # Let convert_image report the error
+                else:
+                    if kept == [entry_stat.st_size, entry_stat.st_mtime_ns]:
+                        logging.info("  Skipping image that did not get smaller as JXL before: %s", entry.path)
+                        self._next_kept_originals[entry.path] = kept
+                        holds_kept_originals = True
+                        continue
+            found_images = True
+            yielded_stems.add(stem)
+            yield entry
+        # Only now every image of the directory has been checked against the kept originals
+        self._listed_directories.add(directory)
+
+        # Only directories without images to convert are cached, so failed conversions are retried.
+        # Kept originals can be rewritten in place without changing the directory mtime, so their
+        # directories are listed every time to check them again.
+        # A directory modified within the mtime granularity of coarse filesystems could still change
+        # without its mtime changing, it is cached once it has settled.
+        if self.use_scan_cache and not found_images and not holds_kept_originals and \
+                time.time_ns() - directory_stat.st_mtime_ns > _SCAN_CACHE_SETTLE_NS:
+            self._next_scan_cache[directory] = directory_key + [[entry.name for entry in subdirectories]]
+        for subdirectory in subdirectories:
+            yield from self._iter_jpegs(subdirectory.path, source_dir, skipped_too_small)
+
+    def _encode_with_cjxl(self, input_filepath, output_filepath):
+        """
+        Encodes a JPEG/JPG file to JXL by running the cjxl command-line tool.
+
+        Returns:
+            tuple: (error_tag (str or None), full_error_message (str or None)), both None on success.
+        """
+        try:
+            # Construct the cjxl command.
+            command = [self.cjxl_path, input_filepath, output_filepath, *self.cjxl_args]
+            # Only build the command line string if it is actually logged
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug("Executing cjxl: %s", " ".join(command))
+
+            # Run the cjxl command. Its stdout is never used and stderr is only decoded on failure.
+            # Python opens files non-inheritable, so the fds don't need to be closed in the child,
+            # which lets subprocess avoid that work (and use posix_spawn where possible).
+            result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                    close_fds=False, check=False)
+        except FileNotFoundError:
+            full_error_message = f"cjxl command not found. Please ensure '{self.cjxl_path}' is in your PATH or provide the full path."
+            logging.critical(full_error_message)
+            return "cjxl_not_found", full_error_message
+        except subprocess.CalledProcessError as e:
+            stderr_output = (e.stderr or b"").decode("utf-8", "replace").strip()
+            return "cjxl_execution_error_subprocess", f"cjxl command execution error: {stderr_output}"
+
+        if result.returncode == 0:
+            return None, None
+
+        # cjxl command failed (non-zero exit code)
+        stderr_output = result.stderr.decode("utf-8", "replace").strip()
+        full_error_message = f"cjxl failed with exit code {result.returncode}: {stderr_output}"
+
+        # Find the first known error in a single pass over stderr
+        match = _CJXL_ERROR_RE.search(stderr_output)
+        error_tag = match.lastgroup if match else "generic_cjxl_failure"
+        return error_tag, full_error_message
+
+    def _encode_with_imagecodecs(self, input_filepath, output_filepath):
+        """
+        Encodes a JPEG/JPG file to JXL in-process using the libjxl bindings of imagecodecs.
+        Like cjxl, the JPEG data is transcoded losslessly, so the original JPEG can be reconstructed.
+
+        Returns:
+            tuple: (error_tag (str or None), full_error_message (str or None)), both None on success.
+        """
+        try:
+            with open(input_filepath, "rb") as f:
+                jpeg_data = f.read()
+        except OSError as e:
+            return "file_system_error", f"Failed to read original file: {e}"
+
+        try:
+            jxl_data = imagecodecs.jpegxl_encode_jpeg(jpeg_data)
+        except Exception as e:
+            return "imagecodecs_encoding_failed", f"imagecodecs failed to encode the JPEG image: {e}"
+
+        try:
+            with open(output_filepath, "wb") as f:
+                f.write(jxl_data)
+        except OSError as e:
+            return "file_system_error", f"Failed to write JXL file: {e}"
+        return None, None
+
+    def convert_image(self, image):
         """
-        Converts a single JPEG/JPG file to JXL using the cjxl command-line tool.
+        Converts a single JPEG/JPG file to JXL using the configured backend
+        (the cjxl command-line tool or imagecodecs).
         If successful, the original file is replaced by the new JXL file.
         If unsuccessful, the original file remains untouched.
+        Only reads the converter's configuration, so it is safe to call from several threads;
+        the caller accounts the returned result in the metrics.
 
         Args:
-            input_filepath (str): The full path to the input JPEG/JPG file.
-            metrics_for_current_dir (dict): The dictionary holding metrics for the current source directory.
+            image (os.DirEntry or str): The input JPEG/JPG file. Passing the os.DirEntry found
+                                        while scanning reuses its cached stat result, a path makes
+                                        the file be stat'ed here.
 
         Returns:
             tuple: (success (bool), original_size (int), converted_size (int),
@@ -198,129 +839,180 @@ class JxlConverter:
         error_tag = None  # A standardized tag for Prometheus label
         full_error_message = None  # The detailed message for logging
         success = False
+        input_filepath = os.fspath(image)
 
         # Determine the temporary output path for the JXL file
         # This ensures the original file is untouched until successful conversion
+        # It lives next to the input file, so its directory is known to exist
         temp_output_filepath = input_filepath + ".jxl.tmp"
-        # Ensure the directory for the temporary JXL file exists
-        os.makedirs(os.path.dirname(temp_output_filepath), exist_ok=True)
+        # Only the extension of the file name is replaced, dots in directory names are kept
+        final_jxl_filepath = os.path.splitext(input_filepath)[0] + ".jxl"
+        temp_may_exist = False  # Whether the temporary file may have been created and still exist
 
         try:
-            original_size = os.path.getsize(input_filepath)
+            # Stat once (cached by a DirEntry): the size feeds the metrics and the timestamps
+            # are copied onto the JXL file
+            source_stat = image.stat() if isinstance(image, os.DirEntry) else os.stat(input_filepath)
+            original_size = source_stat.st_size
         except OSError as e:
             error_tag = "file_system_error"
             full_error_message = f"Failed to get original file size: {e}"
-            logging.error(f"Error processing {input_filepath}: {full_error_message}")
+            logging.error("Error processing %s: %s", input_filepath, full_error_message)
             return False, 0, 0, 0, error_tag, full_error_message
 
         start_time = time.time()
         try:
-            # Construct the cjxl command.
-            command = [self.cjxl_path, input_filepath, temp_output_filepath]
-            logging.debug(f"Executing cjxl: {' '.join(command)}")
-
-            # Run the cjxl command
-            result = subprocess.run(command, capture_output=True, text=True, check=False)
+            # The encoder creates the temporary file, even if it fails halfway
+            temp_may_exist = True
+            if self.backend == "imagecodecs":
+                error_tag, full_error_message = self._encode_with_imagecodecs(input_filepath, temp_output_filepath)
+            else:
+                error_tag, full_error_message = self._encode_with_cjxl(input_filepath, temp_output_filepath)
             end_time = time.time()
             duration = end_time - start_time
 
-            if result.returncode == 0:
-                # cjxl command executed successfully
-                final_jxl_filepath = ""  # Define here to be available in except block
+            if error_tag is None:
+                # Encoding finished successfully
                 try:
                     converted_size = os.path.getsize(temp_output_filepath)
-                    final_jxl_filepath = os.path.splitext(input_filepath)[0] + ".jxl"
-
-                    # First, rename the temporary JXL file to its final name.
-                    os.rename(temp_output_filepath, final_jxl_filepath)
-
-                    # --- MODIFICATION START ---
-                    # Try to preserve timestamp. This is now a critical step for success.
-                    try:
-                        # Use 'touch -r' to copy timestamps. This is a critical step.
-                        touch_command = ['touch', '-r', input_filepath, final_jxl_filepath]
-                        subprocess.run(touch_command, check=True, capture_output=True, text=True)
-                        logging.info(f"Successfully preserved timestamp for {final_jxl_filepath}.")
-
-                        # Only if touch succeeds, remove original and mark as successful.
-                        os.remove(input_filepath)
-                        success = True
-                        logging.info(f"Successfully converted and replaced {input_filepath} -> {final_jxl_filepath}. "
-                                     f"Original: {original_size} bytes, Converted: {converted_size} bytes.")
-
-                    except (FileNotFoundError, subprocess.CalledProcessError, Exception) as e:
-                        # If touch fails, the entire operation is a failure.
-                        success = False
-                        error_tag = "timestamp_preservation_failed"
-
-                        if isinstance(e, FileNotFoundError):
-                            full_error_message = "'touch' command not found. Cannot preserve timestamp. Aborting replacement."
-                        elif isinstance(e, subprocess.CalledProcessError):
-                            full_error_message = f"Failed to preserve timestamp using 'touch' (Error: {e.stderr.strip()}). Aborting replacement."
-                        else:
-                            full_error_message = f"An unexpected error occurred during timestamp preservation ({e}). Aborting replacement."
-
-                        logging.error(f"For {input_filepath}: {full_error_message}")
 
-                        # IMPORTANT: Clean up the created JXL file and leave the original.
+                    if converted_size >= original_size:
+                        # Replacing the original would not save any space, keep it untouched.
+                        # The temporary JXL file is cleaned up below.
+                        error_tag = "no_size_reduction"
+                        full_error_message = f"JXL file ({converted_size} bytes) is not smaller than " \
+                                             f"the original ({original_size} bytes), keeping the original."
+                        logging.info("For %s: %s", input_filepath, full_error_message)
+                    else:
+                        # Preserve the timestamp while the JXL file is still temporary, so a JXL file with
+                        # the final name always has it. This is a critical step for success.
                         try:
-                            os.remove(final_jxl_filepath)
-                            logging.info(f"Removed incomplete JXL file: {final_jxl_filepath}")
-                        except OSError as remove_error:
-                            logging.error(f"Failed to remove incomplete JXL file {final_jxl_filepath}: {remove_error}")
-                    # --- MODIFICATION END ---
+                            os.utime(temp_output_filepath, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+                            logging.info("Successfully preserved timestamp for %s.", final_jxl_filepath)
+                        except OSError as e:
+                            # If the timestamp cannot be copied, the entire operation is a failure.
+                            # The temporary JXL file is cleaned up below and the original left in place.
+                            error_tag = "timestamp_preservation_failed"
+                            full_error_message = f"Failed to preserve timestamp ({e}). Aborting replacement."
+                            logging.error("For %s: %s", input_filepath, full_error_message)
+                        else:
+                            # Move the finished JXL file to its final name, and only then remove the
+                            # original. An existing JXL file there belongs to another image, as images
+                            # with a JXL file are not converted, so it is never replaced.
+                            try:
+                                _rename_no_replace(temp_output_filepath, final_jxl_filepath)
+                            except FileExistsError:
+                                error_tag = "jxl_file_exists"
+                                full_error_message = f"{final_jxl_filepath} already exists, keeping the original."
+                                logging.error("For %s: %s", input_filepath, full_error_message)
+                            else:
+                                temp_may_exist = False
+                                os.remove(input_filepath)
+                                success = True
+                                logging.info("Successfully converted and replaced %s -> %s. "
+                                             "Original: %s bytes, Converted: %s bytes.",
+                                             input_filepath, final_jxl_filepath, original_size, converted_size)
 
                 except OSError as e:
                     error_tag = "file_system_error"
                     full_error_message = f"Post-conversion file operation failed (e.g., rename/remove): {e}. " \
                                          f"Original file might be missing or temp JXL not properly moved."
-                    logging.error(f"Error during file replacement for {input_filepath}: {full_error_message}")
+                    logging.error("Error during file replacement for %s: %s", input_filepath, full_error_message)
                     success = False
             else:
-                # cjxl command failed (non-zero exit code)
-                stderr_output = result.stderr.strip()
-                full_error_message = f"cjxl failed with exit code {result.returncode}: {stderr_output}"
-
-                if "Error while decoding the JPEG image" in stderr_output:
-                    error_tag = "corrupt_or_unsupported_jpeg"
-                elif "unsupported input type" in stderr_output.lower():
-                    error_tag = "unsupported_input_type"
-                elif "out of memory" in stderr_output.lower():
-                    error_tag = "cjxl_out_of_memory"
-                elif "EncodeImageJXL() failed" in stderr_output:
-                    error_tag = "cjxl_encoding_failed"
-                else:
-                    error_tag = "generic_cjxl_failure"
-
-                logging.error(f"Conversion failed for {input_filepath}: {full_error_message}")
+                logging.error("Conversion failed for %s: %s", input_filepath, full_error_message)
                 success = False
 
-        except FileNotFoundError:
-            error_tag = "cjxl_not_found"
-            full_error_message = f"cjxl command not found. Please ensure '{self.cjxl_path}' is in your PATH or provide the full path."
-            logging.critical(full_error_message)
-            success = False
-        except subprocess.CalledProcessError as e:
-            error_tag = "cjxl_execution_error_subprocess"
-            full_error_message = f"cjxl command execution error: {e.stderr.strip()}"
-            logging.error(f"Conversion failed for {input_filepath}: {full_error_message}")
-            success = False
         except Exception as e:
             error_tag = "unexpected_python_error"
             full_error_message = f"An unexpected error occurred during conversion process: {e}"
-            logging.error(f"Unexpected error for {input_filepath}: {full_error_message}")
+            logging.error("Unexpected error for %s: %s", input_filepath, full_error_message)
             success = False
         finally:
-            # Clean up the temporary JXL file if it still exists
-            if os.path.exists(temp_output_filepath):
+            # Clean up the temporary JXL file if it still exists. After a successful rename it can't,
+            # which saves checking for it.
+            if temp_may_exist and os.path.exists(temp_output_filepath):
                 try:
                     os.remove(temp_output_filepath)
-                    logging.debug(f"Cleaned up temporary file: {temp_output_filepath}")
+                    logging.debug("Cleaned up temporary file: %s", temp_output_filepath)
                 except OSError as e:
-                    logging.warning(f"Could not remove temporary file {temp_output_filepath}: {e}")
+                    logging.warning("Could not remove temporary file %s: %s", temp_output_filepath, e)
 
         return success, original_size, converted_size, duration, error_tag, full_error_message
 
+    def _scan_images(self, work_queue, skipped_too_small):
+        """
+        Producer of the conversion pipeline: walks all source directories and puts a
+        (source_dir, os.DirEntry) pair for every image on the work queue, followed by
+        one None sentinel per conversion worker. Images below min_size_bytes are counted
+        per source directory in the skipped_too_small Counter instead.
+        """
+        try:
+            for source_dir in self.metrics_data:
+                logging.info("Scanning images in directory: '%s'", source_dir)
+                for entry in self._iter_jpegs(source_dir, source_dir, skipped_too_small):
+                    if self._stop_event.is_set():
+                        return
+                    work_queue.put((source_dir, entry))
+        finally:
+            for _ in range(self.jobs):
+                work_queue.put(None)
+
+    def _conversion_worker(self, work_queue, results_queue):
+        """
+        Consumer of the conversion pipeline: converts images from the work queue until it gets
+        a None sentinel. Puts a (source_dir, entry, result) tuple on the results queue for
+        every converted image, followed by a None sentinel once finished. Once the pipeline is
+        stopped, the remaining images are taken off the queue without converting them.
+        """
+        try:
+            while (item := work_queue.get()) is not None:
+                if self._stop_event.is_set():
+                    continue
+                source_dir, entry = item
+                result = self.convert_image(entry)
+                results_queue.put((source_dir, entry, result))
+        finally:
+            results_queue.put(None)
+
+    def _account_result(self, source_dir, entry, conversion_result, kept_originals):
+        """
+        Updates the metrics of a source directory with the result of convert_image for one image,
+        and records the image in kept_originals if it did not get smaller as JXL.
+        Only called on the main thread.
+        """
+        filepath = entry.path
+        metrics = self.metrics_data[source_dir]
+        success, original_size, converted_size, duration, error_tag, full_error_message = conversion_result
+        logging.info("  Processed image: %s", filepath)
+
+        metrics.total_conversions += 1  # Increment total for this directory
+
+        if success:
+            metrics.successful_conversions += 1
+            saved_bytes = original_size - converted_size
+            metrics.total_space_saved_bytes += saved_bytes
+            metrics.last_interval_space_saved_bytes += saved_bytes
+            # Update new metrics for average size calculation
+            metrics.total_original_bytes_processed += original_size
+            metrics.total_converted_bytes_processed += converted_size
+
+            logging.info("    -> Successfully saved %s bytes (Original: %s, JXL: %s).",
+                         saved_bytes, original_size, converted_size)
+        else:
+            metrics.failed_conversions += 1
+            # Use the error_tag directly as the reason_key for Prometheus label
+            reason_key = error_tag if error_tag else "unknown_error"  # Fallback if error_tag is None
+            metrics.failed_reasons[reason_key] += 1
+            if error_tag == "no_size_reduction":
+                # Not an error with the image, it just doesn't compress any better. Remember it so
+                # it isn't encoded again while unchanged, the stat is cached by the DirEntry.
+                entry_stat = entry.stat()
+                kept_originals[filepath] = [entry_stat.st_size, entry_stat.st_mtime_ns]
+                logging.info("    -> Kept %s. Reason: %s", os.path.basename(filepath), full_error_message)
+            else:
+                logging.error("    -> Failed to convert %s. Reason: %s", os.path.basename(filepath), full_error_message)
+
     def run_conversion(self):
         """
         Traverses each configured source directory, converts JPEG/JPG files, and updates metrics
@@ -329,53 +1021,76 @@ class JxlConverter:
         """
         logging.info("Starting JXL conversion process for all configured directories...")
 
-        # Reset last interval space saved for all directories before starting
+        # Directories and kept originals seen during this scan replace the previous scan cache
+        self._next_scan_cache = {}
+        self._next_kept_originals = {}
+        self._listed_directories = set()
+        self._stop_event.clear()
+
+        # Reset the last interval values for all directories before starting
         for metrics in self.metrics_data.values():
-            metrics['last_interval_space_saved_bytes'] = 0
+            metrics.last_interval_space_saved_bytes = 0
+            metrics.last_interval_skipped_too_small = 0
+
+        # The scanner thread streams images into a bounded queue, so conversions start right away
+        # and memory stays bounded regardless of the size of the directory trees.
+        work_queue = self._work_queue = queue.Queue(maxsize=2 * self.jobs)
+        results_queue = queue.Queue()
+        skipped_too_small = Counter()  # Only touched by the scanner thread until it is joined
+        kept_originals = {}  # Only touched by the main thread, merged into the scan cache once the scanner is joined
+        scanner = threading.Thread(target=self._scan_images, args=(work_queue, skipped_too_small),
+                                   name="jxl-scanner", daemon=True)
+        scanner.start()
+
+        # cjxl runs as an external process, so threads are enough to keep all cores busy.
+        # Metrics are only ever updated here on the main thread, so no locking is needed.
+        # The worker pool is reused across runs instead of starting new threads every time.
+        for _ in range(self.jobs):
+            self._pool.submit(self._conversion_worker, work_queue, results_queue)
+        active_workers = self.jobs
+        try:
+            while active_workers:
+                result = results_queue.get()
+                if result is None:
+                    # A worker has finished
+                    active_workers -= 1
+                    continue
+                self._account_result(*result, kept_originals)
+
+                # Keep the metrics files current during long runs, but not for every single image
+                now = time.monotonic()
+                if now - self._last_metrics_emit >= self._metrics_min_interval:
+                    self._generate_metrics_file()
+                    self._last_metrics_emit = now
+        finally:
+            if active_workers:
+                # Interrupted: stop scanning and converting, but still account the images
+                # that were already converted, as their originals are gone
+                logging.warning("Conversion interrupted, waiting for running conversions to finish...")
+                self._stop_event.set()
+                while active_workers:
+                    result = results_queue.get()
+                    if result is None:
+                        active_workers -= 1
+                    else:
+                        self._account_result(*result, kept_originals)
+
+            scanner.join()
+            for source_dir, skipped_count in skipped_too_small.items():
+                self.metrics_data[source_dir].last_interval_skipped_too_small = skipped_count
+            self._next_kept_originals.update(kept_originals)
+            self._save_scan_cache()
+
+            # Always write the final metrics files, also when interrupted. They save the state,
+            # which has to include every image accounted above, as their originals are gone.
+            self._generate_metrics_file()
+            self._last_metrics_emit = time.monotonic()
 
-        # Process each source directory
-        for source_dir, metrics in self.metrics_data.items():
-            logging.info(f"Processing images in directory: '{source_dir}'")
-            # Walk through the directory tree for the current source_dir
-            for root, _, files in os.walk(source_dir):
-                for file in files:
-                    # Check for common JPEG file extensions (case-insensitive)
-                    if file.lower().endswith(('.jpg', '.jpeg')):
-                        filepath = os.path.join(root, file)
-                        logging.info(f"  Processing image: {filepath}")
-
-                        # Pass the specific metrics dictionary for the current directory
-                        success, original_size, converted_size, duration, error_tag, full_error_message = \
-                            self.convert_image(filepath, metrics)
-
-                        metrics['total_conversions'] += 1  # Increment total for this directory
-
-                        if success:
-                            metrics['successful_conversions'] += 1
-                            saved_bytes = original_size - converted_size
-                            metrics['total_space_saved_bytes'] += saved_bytes
-                            metrics['last_interval_space_saved_bytes'] += saved_bytes
-                            # Update new metrics for average size calculation
-                            metrics['total_original_bytes_processed'] += original_size
-                            metrics['total_converted_bytes_processed'] += converted_size
-
-                            logging.info(
-                                f"    -> Successfully saved {saved_bytes} bytes (Original: {original_size}, JXL: {converted_size}).")
-                        else:
-                            metrics['failed_conversions'] += 1
-                            # Use the error_tag directly as the reason_key for Prometheus label
-                            reason_key = error_tag if error_tag else "unknown_error"  # Fallback if error_tag is None
-                            metrics['failed_reasons'][reason_key] += 1
-                            logging.error(f"    -> Failed to convert {file}. Reason: {full_error_message}")
-            logging.info(f"Finished processing directory: '{source_dir}'")
-
-        # After processing all directories, generate the metrics files
-        self._generate_metrics_file()
         logging.info("JXL conversion process completed for all directories.")
         logging.info(f"--- Global Conversion Summary ---")
-        total_overall_successful = sum(m['successful_conversions'] for m in self.metrics_data.values())
-        total_overall_failed = sum(m['failed_conversions'] for m in self.metrics_data.values())
-        total_overall_saved = sum(m['total_space_saved_bytes'] for m in self.metrics_data.values())
+        total_overall_successful = sum(m.successful_conversions for m in self.metrics_data.values())
+        total_overall_failed = sum(m.failed_conversions for m in self.metrics_data.values())
+        total_overall_saved = sum(m.total_space_saved_bytes for m in self.metrics_data.values())
         total_overall_processed = total_overall_successful + total_overall_failed
 
         logging.info(f"Overall Total Images Processed: {total_overall_processed}")
@@ -385,12 +1100,14 @@ class JxlConverter:
         logging.info(f"\n--- Per-Directory Summaries ---")
         for source_dir, metrics in self.metrics_data.items():
             logging.info(f"Directory: '{source_dir}'")
-            logging.info(f"  Total Processed: {metrics['total_conversions']}")
-            logging.info(f"  Successful: {metrics['successful_conversions']}")
-            logging.info(f"  Failed: {metrics['failed_conversions']}")
-            logging.info(f"  Space Saved This Run: {metrics['last_interval_space_saved_bytes']} bytes")
-            logging.info(f"  Total Space Saved for Dir: {metrics['total_space_saved_bytes']} bytes")
-            logging.info(f"  Failure Reasons for Dir: {dict(metrics['failed_reasons'])}")
+            logging.info(f"  Total Processed: {metrics.total_conversions}")
+            logging.info(f"  Successful: {metrics.successful_conversions}")
+            logging.info(f"  Failed: {metrics.failed_conversions}")
+            logging.info(f"  Skipped Too Small This Run: {metrics.last_interval_skipped_too_small}")
+            logging.info(f"  Space Saved This Run: {metrics.last_interval_space_saved_bytes} bytes")
+            logging.info(f"  Total Space Saved for Dir: {metrics.total_space_saved_bytes} bytes")
+            failure_reasons = {reason: count for reason, count in metrics.failed_reasons.items() if count}
+            logging.info(f"  Failure Reasons for Dir: {failure_reasons}")
             logging.info("-" * 40)
 
 
@@ -406,19 +1123,60 @@ if __name__ == "__main__":
     parser.add_argument("--cjxl-path", dest="cjxl_command_path",
                         default="cjxl",
                         help="The path to the cjxl executable. Default: cjxl (assumes it's in PATH)")
+    parser.add_argument("--jobs", "-j", dest="jobs", type=int,
+                        default=None,
+                        help="Number of conversions to run in parallel, at least 1. Default: number of CPUs")
+    parser.add_argument("--backend", dest="backend", choices=("auto", "cli", "imagecodecs"),
+                        default="auto",
+                        help="Encode with the cjxl executable ('cli') or in-process with the imagecodecs "
+                             "package ('imagecodecs'). 'auto' uses imagecodecs if it is installed and neither "
+                             "--cjxl-path nor any --cjxl-* options are given. Default: auto")
+    parser.add_argument("--cjxl-effort", dest="cjxl_effort", type=int,
+                        default=None,
+                        help="cjxl encoder effort (1-10), lower is faster. Default: cjxl default (7)")
+    parser.add_argument("--cjxl-distance", dest="cjxl_distance", type=float,
+                        default=None,
+                        help="cjxl Butteraugli distance, 0 is lossless. Requires --cjxl-lossless-jpeg 0 "
+                             "unless 0. Default: cjxl default")
+    parser.add_argument("--cjxl-lossless-jpeg", dest="cjxl_lossless_jpeg", type=int, choices=(0, 1),
+                        default=None,
+                        help="1 to losslessly transcode the JPEG data, 0 to re-encode the pixels. "
+                             "Default: cjxl default (1)")
+    parser.add_argument("--cjxl-decoding-speed", dest="cjxl_faster_decoding", type=int, choices=range(5),
+                        default=None,
+                        help="cjxl faster decoding tier (0-4), trades size for decoding speed. "
+                             "Default: cjxl default (0)")
+    parser.add_argument("--min-size-bytes", dest="min_size_bytes", type=int,
+                        default=0,
+                        help="Skip images smaller than this many bytes, e.g. thumbnails. Default: 0 (convert all)")
+    parser.add_argument("--no-scan-cache", dest="use_scan_cache", action="store_false",
+                        help="Always list every directory and encode every image instead of skipping "
+                             "unchanged directories that had nothing to convert and unchanged images "
+                             "that did not get smaller as JXL in a previous run")
+    parser.add_argument("--create-dummies", dest="create_dummies", action="store_true",
+                        help="Fill missing source directories with dummy JPG files for testing")
 
     args = parser.parse_args()
 
     # Initialize and run the converter
-    converter_instance = None
     try:
         # Use args.source_directories which is already a list
-        converter_instance = JxlConverter(args.source_directories, args.metrics_directory, args.cjxl_command_path)
-        converter_instance.run_conversion()
+        with JxlConverter(args.source_directories, args.metrics_directory, args.cjxl_command_path,
+                          jobs=args.jobs, backend=args.backend,
+                          effort=args.cjxl_effort, distance=args.cjxl_distance,
+                          lossless_jpeg=args.cjxl_lossless_jpeg,
+                          faster_decoding=args.cjxl_faster_decoding,
+                          min_size_bytes=args.min_size_bytes,
+                          use_scan_cache=args.use_scan_cache,
+                          create_dummies=args.create_dummies) as converter_instance:
+            converter_instance.run_conversion()
     except FileNotFoundError as e:
         # Catch specific FileNotFoundError raised by JxlConverter if source_directory is problematic
         logging.critical(f"Initialization failed: {e}")
         logging.critical("Please ensure the source directories exist and are accessible.")
+    except ValueError as e:
+        # Raised by JxlConverter for an invalid number of jobs or invalid cjxl options
+        logging.critical(f"Invalid configuration: {e}")
     except Exception as e:
         # Catch any other unexpected exceptions during initialization or runtime
         logging.critical(f"An unhandled critical error occurred: {e}", exc_info=True)